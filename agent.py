@@ -8,8 +8,8 @@ Pipeline:
   Google Keep JSON → Parse → LLM Classification → Deterministic Scoring → Telegram Alert
 
 Architecture Principles:
-  - LLM does reasoning (classification, extraction, dedup)
-  - Python does control (scoring, ranking, validation)
+  - LLM does reasoning (classification, extraction)
+  - Python does control (dedup, scoring, ranking, validation)
   - Never let LLM control priority fully
 
 Usage:
@@ -24,21 +24,32 @@ Usage:
 
 import os
 import sys
-import json
+import asyncio
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
-from llm_extractor import extract_and_classify
-from scoring import score_tasks, detect_domain_imbalance
+import orjson
+
+from llm_extractor import extract_and_classify, prune_cache, format_note, estimate_tokens, SYSTEM_PROMPT_TOKENS, MAX_NOTES_PER_CALL
+from dedup import collapse_exact_duplicates, expand_note_ids, find_duplicate_groups
+from scoring import score_tasks, top_k_tasks, detect_domain_imbalance
 from telegram_notify import send_telegram_message
 
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
 KEEP_DATA_PATH = Path(os.getenv("KEEP_DATA_PATH", "keep_data/"))
-MAX_NOTES_PER_CHUNK = 30  # avoid token overflow — chunk large exports
+MAX_NOTES_PER_CHUNK = MAX_NOTES_PER_CALL  # derived from the LLM output budget — keeps the JSON reply under max_tokens
+TOKEN_BUDGET_PER_CHUNK = int(os.getenv("TOKEN_BUDGET_PER_CHUNK", "4000"))  # system prompt + notes
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "5"))  # in-flight OpenAI calls — stay under RPM/TPM limits
+LOAD_WORKERS = 16  # threads for reading per-note Takeout files
+TOP_K = int(os.getenv("KEEP_TOP_K", "5"))  # priorities shown in the brief
+FULL_SORT = os.getenv("FULL_SORT") == "1"  # rank every task in the saved JSON (otherwise unsorted)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+_DATE_FMT = "%A, %d %B %Y"  # brief header date
 
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL),
@@ -68,25 +79,27 @@ def load_keep_notes(data_path: Path) -> list[dict]:
         "labels": list[str],
         "is_archived": bool,
         "is_trashed": bool,
-        "raw": dict
+        "raw": dict,
+        "_formatted": str (prompt text, see llm_extractor.format_note)
     }
     """
     notes = []
 
     if data_path.is_file() and data_path.suffix == ".json":
-        raw = json.loads(data_path.read_text(encoding="utf-8"))
+        raw = orjson.loads(data_path.read_bytes())
         raw_notes = raw if isinstance(raw, list) else [raw]
     elif data_path.is_dir():
         raw_notes = []
-        for f in sorted(data_path.glob("*.json")):
-            try:
-                parsed = json.loads(f.read_text(encoding="utf-8"))
-                if isinstance(parsed, list):
-                    raw_notes.extend(parsed)
-                else:
-                    raw_notes.append(parsed)
-            except json.JSONDecodeError:
-                log.warning(f"Skipping malformed file: {f.name}")
+        # scandir: DirEntry caches the file type — no per-file stat / Path objects
+        with os.scandir(data_path) as it:
+            files = sorted(e.path for e in it if e.name.endswith(".json") and e.is_file())
+        with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as ex:
+            parsed_files = list(ex.map(_load_json_file, files))
+        for parsed in parsed_files:
+            if isinstance(parsed, list):
+                raw_notes.extend(parsed)
+            elif parsed is not None:
+                raw_notes.append(parsed)
     else:
         log.error(f"Keep data path not found: {data_path}")
         sys.exit(1)
@@ -102,6 +115,11 @@ def load_keep_notes(data_path: Path) -> list[dict]:
             log.warning(f"Skipping unexpected item type: {type(item)}")
     raw_notes = flat_notes
 
+    # Ids must be unique — dedup re-expands results by id. Fallback ids
+    # skip any id a note declares explicitly; repeated ids get a suffix.
+    taken_ids = {raw["id"] for raw in raw_notes if raw.get("id")}
+    used_ids: set[str] = set()
+
     for i, raw in enumerate(raw_notes):
         # Google Takeout uses 'textContent' or 'listContent'
         content_parts = []
@@ -129,8 +147,13 @@ def load_keep_notes(data_path: Path) -> list[dict]:
 
         labels = [l.get("name", "") for l in raw.get("labels", [])]
 
-        notes.append({
-            "id": raw.get("id", f"note_{i:04d}"),
+        note_id = raw.get("id") or f"note_{i:04d}"
+        if note_id in used_ids or (not raw.get("id") and note_id in taken_ids):
+            note_id = _next_free_id(note_id, used_ids | taken_ids)
+        used_ids.add(note_id)
+
+        note = {
+            "id": note_id,
             "title": title,
             "content": content,
             "created_at": created,
@@ -139,40 +162,92 @@ def load_keep_notes(data_path: Path) -> list[dict]:
             "is_archived": raw.get("isArchived", False),
             "is_trashed": False,
             "raw": raw,
-        })
+        }
+        format_note(note)  # precompute prompt text once — reused by chunking + every retry
+        notes.append(note)
 
     log.info(f"Loaded {len(notes)} notes from {data_path}")
     return notes
 
 
+def _next_free_id(base: str, taken: set[str]) -> str:
+    """First `base_N` (N ≥ 2) not already taken."""
+    n = 2
+    while f"{base}_{n}" in taken:
+        n += 1
+    return f"{base}_{n}"
+
+
+def _load_json_file(path: str):
+    """Read and parse one Takeout file. Returns None if the file is malformed."""
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except orjson.JSONDecodeError:
+        log.warning(f"Skipping malformed file: {os.path.basename(path)}")
+        return None
+
+
 def _parse_timestamp(ts) -> str:
     """Convert Takeout microsecond timestamp or ISO string to ISO format."""
+    if isinstance(ts, str):
+        return ts
+    if ts is None or isinstance(ts, (int, float)):
+        return _parse_epoch(ts)
+    return str(ts)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_epoch(ts: int | float | None) -> str:
+    """Cached — bulk-imported notes share timestamps. None maps to a single 'now' per run."""
     if ts is None:
         return datetime.now(timezone.utc).isoformat()
-    if isinstance(ts, (int, float)):
-        # Takeout gives microseconds since epoch
-        if ts > 1e15:
-            ts = ts / 1_000_000
-        elif ts > 1e12:
-            ts = ts / 1_000
-        return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
-    return str(ts)
+    # Takeout gives microseconds since epoch
+    if ts > 1e15:
+        ts = ts / 1_000_000
+    elif ts > 1e12:
+        ts = ts / 1_000
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def chunk_notes(
+    notes: list[dict],
+    chunk_size: int = MAX_NOTES_PER_CHUNK,
+    token_budget: int = TOKEN_BUDGET_PER_CHUNK,
+) -> list[list[dict]]:
+    """
+    Greedily pack notes (in order) into chunks that fit the input token
+    budget, so long notes don't overflow a chunk and short notes don't
+    waste one. `chunk_size` only guards the output side: a chunk never
+    holds more notes than the model can answer within max_tokens.
+    """
+    note_budget = token_budget - SYSTEM_PROMPT_TOKENS
+    chunks = []
+    current, current_tokens = [], 0
 
+    for note in notes:
+        tokens = estimate_tokens(format_note(note))
+        if current and (current_tokens + tokens > note_budget or len(current) >= chunk_size):
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(note)
+        current_tokens += tokens
 
-def chunk_notes(notes: list[dict], chunk_size: int = MAX_NOTES_PER_CHUNK) -> list[list[dict]]:
-    """Split notes into chunks to avoid LLM token limits."""
-    return [notes[i:i + chunk_size] for i in range(0, len(notes), chunk_size)]
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 # ===========================================================================
 # 2. PROCESS — Orchestrate LLM extraction + deterministic scoring
 # ===========================================================================
 
-def process_notes(notes: list[dict]) -> dict:
+async def process_notes(notes: list[dict], concurrency: int = LLM_CONCURRENCY) -> dict:
     """
     Full pipeline:
-      1. Chunk notes
-      2. LLM classifies each chunk → tasks, ideas, references, vague, duplicates
+      1. Collapse exact duplicates, group near duplicates, chunk the rest
+      2. LLM classifies each chunk → tasks, ideas, references, vague
+         (chunks are dispatched concurrently, bounded by `concurrency`)
       3. Merge chunk results
       4. Deterministic scoring on extracted tasks
       5. Domain imbalance detection
@@ -181,14 +256,30 @@ def process_notes(notes: list[dict]) -> dict:
     all_ideas = []
     all_references = []
     all_vague = []
-    all_duplicates = []
 
-    chunks = chunk_notes(notes)
-    log.info(f"Processing {len(notes)} notes in {len(chunks)} chunk(s)")
+    # Deterministic dedup — exact copies never reach the LLM
+    unique_notes, duplicate_ids = collapse_exact_duplicates(notes)
+    all_duplicates = find_duplicate_groups(unique_notes, duplicate_ids)
+
+    chunks = chunk_notes(unique_notes)
+    log.info(f"Processing {len(unique_notes)} unique notes in {len(chunks)} chunk(s), concurrency={concurrency}")
 
-    for i, chunk in enumerate(chunks):
-        log.info(f"Processing chunk {i+1}/{len(chunks)} ({len(chunk)} notes)")
-        result = extract_and_classify(chunk)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _classify(i: int, chunk: list[dict]) -> dict | None:
+        async with semaphore:
+            log.info(f"Processing chunk {i+1}/{len(chunks)} ({len(chunk)} notes)")
+            return await extract_and_classify(chunk)
+
+    results = await asyncio.gather(
+        *(_classify(i, chunk) for i, chunk in enumerate(chunks)),
+        return_exceptions=True,
+    )
+
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            log.error(f"Chunk {i+1} failed: {result}")
+            result = None
 
         if not result:
             log.warning(f"Chunk {i+1} returned empty result — skipping")
@@ -199,7 +290,14 @@ def process_notes(notes: list[dict]) -> dict:
         all_ideas.extend(result.get("ideas", []))
         all_references.extend(result.get("references", []))
         all_vague.extend(result.get("vague", []))
-        all_duplicates.extend(result.get("duplicates", []))
+
+    # Anything extracted from a collapsed note applies to all of its copies
+    for t in all_tasks:
+        t["source_note_ids"] = expand_note_ids(t.get("source_note_ids", []), duplicate_ids)
+        t["merged_from"] = expand_note_ids(t.get("merged_from", []), duplicate_ids)
+    for item in all_ideas + all_references + all_vague:
+        source_id = item.get("source_note_id")
+        item["source_note_ids"] = expand_note_ids([source_id] if source_id else [], duplicate_ids)
 
     log.info(
         f"Extraction complete: {len(all_tasks)} tasks, {len(all_ideas)} ideas, "
@@ -207,7 +305,7 @@ def process_notes(notes: list[dict]) -> dict:
     )
 
     # Deterministic scoring — Python controls priority, not LLM
-    scored_tasks = score_tasks(all_tasks)
+    scored_tasks = score_tasks(all_tasks, sort=FULL_SORT)
     domain_warnings = detect_domain_imbalance(scored_tasks)
 
     return {
@@ -219,6 +317,7 @@ def process_notes(notes: list[dict]) -> dict:
         "domain_warnings": domain_warnings,
         "stats": {
             "total_notes": len(notes),
+            "unique_notes": len(unique_notes),
             "tasks_extracted": len(all_tasks),
             "ideas_extracted": len(all_ideas),
             "vague_count": len(all_vague),
@@ -239,12 +338,13 @@ def format_telegram_message(result: dict) -> str:
     """
     stats = result["stats"]
     tasks = result["tasks"]
-    top_tasks = tasks[:5]  # Top 3–5 priorities
+    top_tasks = top_k_tasks(tasks, TOP_K)
 
-    lines = []
-    lines.append("🧠 *KEEP INTELLIGENCE BRIEF*")
-    lines.append(f"_{datetime.now().strftime('%A, %d %B %Y')}_")
-    lines.append("")
+    lines = [
+        "🧠 *KEEP INTELLIGENCE BRIEF*",
+        f"_{datetime.now().strftime(_DATE_FMT)}_",
+        "",
+    ]
 
     # --- Top Priorities ---
     if top_tasks:
@@ -295,12 +395,13 @@ def main():
         sys.exit(1)
 
     # 2. Process
-    result = process_notes(notes)
+    result = asyncio.run(process_notes(notes))
+    prune_cache()
 
     # 3. Save full results to JSON (for audit / future phases)
     output_path = Path("output/keep_analysis.json")
     output_path.parent.mkdir(exist_ok=True)
-    output_path.write_text(json.dumps(result, indent=2, default=str), encoding="utf-8")
+    output_path.write_bytes(orjson.dumps(result, default=str, option=orjson.OPT_INDENT_2))
     log.info(f"Full analysis saved to {output_path}")
 
     # 4. Notify
@@ -0,0 +1,154 @@
+"""
+🧹 Duplicate Detection
+========================
+Deterministic duplicate detection — runs in Python before the LLM sees anything.
+
+Two passes:
+  1. Exact: byte-identical notes (same title + content) are collapsed so only
+     one copy is sent to the LLM
+  2. Near: RapidFuzz similarity over the remaining notes groups reworded /
+     re-shared copies into duplicate groups
+
+Design:
+  - Duplicate grouping is control, not reasoning — no tokens spent on it
+  - Candidates come from a fast token-set pass (C++), then a token-sort
+    ratio confirms them — still order-insensitive, so reordered lists match,
+    but short notes aren't swallowed by long ones
+  - Notes are compared in length order, and only against notes short enough
+    to pass the confirm score, with row blocks spread over a thread pool
+"""
+
+import os
+import hashlib
+import logging
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from rapidfuzz import fuzz, process, utils
+
+log = logging.getLogger("keep_agent.dedup")
+
+# ---------------------------------------------------------------------------
+# Tunable thresholds (0–100)
+# ---------------------------------------------------------------------------
+NEAR_DUP_CANDIDATE_SCORE = 85  # token_set_ratio — word overlap, order-insensitive
+NEAR_DUP_CONFIRM_SCORE = 70    # token_sort_ratio — order-insensitive, rejects short-note-inside-long-note matches
+NEAR_DUP_ROW_BLOCK = 64        # rows per thread-pool task — RapidFuzz scorers release the GIL
+
+
+# ===========================================================================
+# Exact duplicates
+# ===========================================================================
+
+def collapse_exact_duplicates(notes: list[dict]) -> tuple[list[dict], dict[str, list[str]]]:
+    """
+    Drop byte-identical notes (same title + content) before LLM dispatch.
+    Returns (unique_notes, rep_id → all note ids) — the map only holds
+    groups with more than one member, keyed by the note kept in `unique`.
+    """
+    hash_to_ids: dict[bytes, list[str]] = {}
+    unique = []
+
+    for note in notes:
+        key = hashlib.blake2b(
+            (note["title"] + "\x1f" + note["content"]).encode("utf-8"), digest_size=16
+        ).digest()
+        if key not in hash_to_ids:
+            hash_to_ids[key] = []
+            unique.append(note)
+        hash_to_ids[key].append(note["id"])
+
+    duplicate_ids = {ids[0]: ids for ids in hash_to_ids.values() if len(ids) > 1}
+    if duplicate_ids:
+        log.info(f"Collapsed {len(notes) - len(unique)} exact duplicate note(s) before LLM dispatch")
+    return unique, duplicate_ids
+
+
+def expand_note_ids(ids: list[str], duplicate_ids: dict[str, list[str]]) -> list[str]:
+    """Re-expand representative note ids to every note they stood in for."""
+    expanded = []
+    for note_id in ids:
+        expanded.extend(duplicate_ids.get(note_id, [note_id]))
+    return expanded
+
+
+# ===========================================================================
+# Near duplicates
+# ===========================================================================
+
+def find_duplicate_groups(notes: list[dict], duplicate_ids: dict[str, list[str]]) -> list[dict]:
+    """
+    Group near-duplicate notes and merge in the exact-duplicate groups.
+    `notes` should already be collapsed by collapse_exact_duplicates.
+
+    Returns groups in the analysis schema:
+    {
+        "canonical": str (content of the most recently updated note),
+        "note_ids": list[str],
+        "action": "discard_older"
+    }
+    """
+    # Compare token-sorted strings: fuzz.ratio on these equals token_sort_ratio,
+    # and their lengths bound it — ratio <= 200 * short / (short + long)
+    sorted_texts = [
+        " ".join(sorted(utils.default_process(f"{n['title']} {n['content']}").split()))
+        for n in notes
+    ]
+    order = sorted(range(len(notes)), key=lambda i: len(sorted_texts[i]))
+    texts = [sorted_texts[i] for i in order]
+    lengths = [len(t) for t in texts]
+
+    def match_rows(start: int, stop: int) -> list[tuple[int, int]]:
+        pairs = []
+        for a in range(start, stop):
+            if not texts[a]:
+                continue
+            # Only later (longer-or-equal) notes that could still pass the confirm score
+            end = bisect_right(lengths, lengths[a] * (200 - NEAR_DUP_CONFIRM_SCORE) // NEAR_DUP_CONFIRM_SCORE, lo=a + 1)
+            matches = process.extract(
+                texts[a],
+                texts[a + 1:end],
+                scorer=fuzz.token_set_ratio,
+                score_cutoff=NEAR_DUP_CANDIDATE_SCORE,
+                limit=None,
+            )
+            for _, _, offset in matches:
+                b = a + 1 + offset
+                if fuzz.ratio(texts[a], texts[b]) >= NEAR_DUP_CONFIRM_SCORE:
+                    pairs.append((order[a], order[b]))
+        return pairs
+
+    blocks = [(i, min(i + NEAR_DUP_ROW_BLOCK, len(texts))) for i in range(0, len(texts), NEAR_DUP_ROW_BLOCK)]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        block_pairs = list(ex.map(lambda blk: match_rows(*blk), blocks))
+
+    parent = list(range(len(notes)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for pairs in block_pairs:
+        for i, j in pairs:
+            parent[find(j)] = find(i)
+
+    components: dict[int, list[dict]] = {}
+    for i, note in enumerate(notes):
+        components.setdefault(find(i), []).append(note)
+
+    groups = []
+    for members in components.values():
+        note_ids = expand_note_ids([n["id"] for n in members], duplicate_ids)
+        if len(note_ids) < 2:
+            continue
+        newest = max(members, key=lambda n: n["updated_at"])
+        groups.append({
+            "canonical": newest["content"] or newest["title"],
+            "note_ids": note_ids,
+            "action": "discard_older",
+        })
+
+    log.info(f"Found {len(groups)} duplicate group(s)")
+    return groups
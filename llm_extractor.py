@@ -4,210 +4,298 @@
 Handles all OpenAI API interaction for note classification.
 
 Principles:
-  - LLM does reasoning (classify, extract, deduplicate)
-  - Output is STRICT JSON — no free-text drift
+  - LLM does reasoning (classify, extract) — dedup is done in dedup.py
+  - Output is STRICT JSON — schema enforced at decode time (Structured Outputs)
   - Chunk-aware to avoid token overflow
-  - Validates response structure before returning
+  - Caches validated results on disk, keyed by prompt content hash
 """
 
 import os
-import json
+import time
+import hashlib
 import logging
-from openai import OpenAI
+import tempfile
+from pathlib import Path
+from typing import Literal
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, LengthFinishReasonError
+from pydantic import BaseModel
 
 log = logging.getLogger("keep_agent.llm")
 
+# ---------------------------------------------------------------------------
+# Response cache — unchanged chunks skip the API entirely on re-runs
+# ---------------------------------------------------------------------------
+CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", ".cache/llm"))
+CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))  # drop entries unused this long; 0 = keep forever
+
 # ---------------------------------------------------------------------------
 # System Prompt — surgical constraints
 # ---------------------------------------------------------------------------
-SYSTEM_PROMPT = """You are a task extraction and classification engine for personal notes.
-
-YOUR JOB:
-Analyse the provided Google Keep notes and classify each into exactly ONE category.
-
-RULES — STRICT:
-1. Convert vague notes into explicit, actionable task descriptions where possible.
-2. Do NOT hallucinate deadlines that don't exist in the note.
-3. Do NOT invent tasks — only extract what is clearly implied or stated.
-4. Preserve original meaning — do not embellish.
-5. Merge semantically similar tasks into one (note the originals in "merged_from").
-6. Return ONLY valid JSON — no markdown, no commentary, no explanation.
-
-CATEGORIES:
-- tasks: Actionable items the user should do
-- ideas: Creative thoughts, project concepts, wishes — not immediately actionable
-- references: Information to keep (links, contacts, codes, recipes, addresses)
-- vague: Notes too unclear to classify — need human clarification
-- duplicates: Groups of notes that say essentially the same thing
-
-DOMAIN TAGS (assign one to each task):
-- health
-- career
-- finance
-- learning
-- relationships
-- admin
-- personal_projects
-- uncategorised
-
-URGENCY DETECTION — flag if ANY of these appear:
-- Words: today, urgent, ASAP, now, immediately, deadline, overdue, critical
-- Dates: any specific date or relative time reference
-- Consequences: "or else", "last chance", "expires", "final"
-
-OUTPUT SCHEMA (strict):
-{
-  "tasks": [
-    {
-      "task": "Clear, actionable description",
-      "domain": "career",
-      "urgency_detected": true,
-      "urgency_words": ["deadline", "Friday"],
-      "deadline_raw": "Friday" or null,
-      "source_note_ids": ["note_0001"],
-      "merged_from": [] or ["note_0002", "note_0003"],
-      "original_snippet": "First 80 chars of original note"
-    }
-  ],
-  "ideas": [
-    {
-      "title": "Short idea title",
-      "content": "Idea description",
-      "domain": "personal_projects",
-      "source_note_id": "note_0005"
-    }
-  ],
-  "references": [
-    {
-      "title": "What this reference is",
-      "content": "The reference content",
-      "source_note_id": "note_0010"
-    }
-  ],
-  "vague": [
-    {
-      "title": "Original note title",
-      "content": "Original note content (truncated)",
-      "source_note_id": "note_0020",
-      "reason": "Why it's unclear"
-    }
-  ],
-  "duplicates": [
-    {
-      "canonical": "The best version of the duplicated content",
-      "note_ids": ["note_0030", "note_0031"],
-      "action": "merge" or "discard_older"
-    }
-  ]
-}
-
-RESPOND WITH ONLY THE JSON OBJECT. NO OTHER TEXT."""
-
-
-def extract_and_classify(notes: list[dict]) -> dict | None:
+SYSTEM_PROMPT = """Task extraction + classification engine for personal notes.
+CLASSIFY NOTES→JSON. Each note → exactly ONE category.
+INPUT per note: #id, T:title, C:content, U:updated, L:labels. Cite ids without "#".
+
+RULES:
+- Vague → explicit actionable task where possible.
+- No invented tasks/deadlines. Preserve meaning.
+- Merge similar tasks → list originals in "merged_from".
+- JSON only.
+
+CATS: tasks=actionable | ideas=concepts/wishes, not actionable | references=info to keep (links, contacts, codes, recipes, addresses) | vague=unclear, needs human
+
+DOMAINS (one per task): health|career|finance|learning|relationships|admin|personal_projects|uncategorised
+
+URGENCY — flag on: today, urgent, ASAP, now, immediately, deadline, overdue, critical; any date/relative time; "or else", "last chance", "expires", "final".
+
+OUTPUT: schema is enforced by the API. Tasks: concise actionable "task"; "urgency_words" = exact trigger words; "deadline_raw" = deadline text or null; "original_snippet" = first 80 chars of source note. Ideas/references/vague: "source_note_id" = one note id; vague "reason" = why unclear.
+"""
+
+# ---------------------------------------------------------------------------
+# Output Schema — passed to the API as a strict JSON schema
+# ---------------------------------------------------------------------------
+Domain = Literal[
+    "health", "career", "finance", "learning", "relationships",
+    "admin", "personal_projects", "uncategorised",
+]
+
+
+class TaskOut(BaseModel):
+    task: str
+    domain: Domain
+    urgency_detected: bool
+    urgency_words: list[str]
+    deadline_raw: str | None
+    source_note_ids: list[str]
+    merged_from: list[str]
+    original_snippet: str
+
+
+class IdeaOut(BaseModel):
+    title: str
+    content: str
+    domain: Domain
+    source_note_id: str
+
+
+class ReferenceOut(BaseModel):
+    title: str
+    content: str
+    source_note_id: str
+
+
+class VagueOut(BaseModel):
+    title: str
+    content: str
+    source_note_id: str
+    reason: str
+
+
+class Classification(BaseModel):
+    tasks: list[TaskOut]
+    ideas: list[IdeaOut]
+    references: list[ReferenceOut]
+    vague: list[VagueOut]
+
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token for English) — good enough for chunk budgeting."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+SYSTEM_PROMPT_TOKENS = estimate_tokens(SYSTEM_PROMPT)
+
+# Output budget — each note yields roughly one JSON item (task / idea / ref / vague)
+MAX_OUTPUT_TOKENS = 4096
+OUTPUT_TOKENS_PER_NOTE = 120  # conservative — task items run ~70+, refs / vague echo up to 500 chars of content
+MAX_NOTES_PER_CALL = MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_NOTE
+
+# ---------------------------------------------------------------------------
+# Shared client — one connection pool reused by every chunk
+# ---------------------------------------------------------------------------
+OPENAI_MAX_RETRIES = 3
+OPENAI_TIMEOUT_SECONDS = 60
+OPENAI_MAX_CONNECTIONS = 20
+
+_client: AsyncOpenAI | None = None
+
+
+def _get_client() -> AsyncOpenAI | None:
+    """Return the shared async OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            log.error("OPENAI_API_KEY not set")
+            return None
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            timeout=OPENAI_TIMEOUT_SECONDS,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS),
+            ),
+        )
+    return _client
+
+
+async def extract_and_classify(notes: list[dict]) -> dict | None:
     """
     Send a chunk of notes to OpenAI for classification.
     Returns validated structured dict or None on failure.
+    Identical prompts are served from the on-disk cache.
+    If the reply overflows max_tokens, the chunk is split in half and retried.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        log.error("OPENAI_API_KEY not set")
-        return None
-
-    client = OpenAI(api_key=api_key)
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
     # Format notes for the prompt
     notes_text = _format_notes_for_prompt(notes)
 
-    user_prompt = f"""Analyse and classify these {len(notes)} Google Keep notes.
+    user_prompt = f"""{len(notes)} NOTES:
+{notes_text}"""
 
-NOTES:
-{notes_text}
+    cache_key = hashlib.sha256((SYSTEM_PROMPT + user_prompt + model).encode("utf-8")).hexdigest()
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        log.info(f"Cache hit for {len(notes)} notes — skipping OpenAI call")
+        return cached
 
-Return ONLY the JSON classification object as specified."""
+    client = _get_client()
+    if client is None:
+        return None
 
     try:
         log.info(f"Sending {len(notes)} notes to OpenAI for classification...")
 
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        response = await client.beta.chat.completions.parse(
+            model=model,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.1,  # Low temp for deterministic classification
-            response_format={"type": "json_object"},
-            max_tokens=4096,
+            response_format=Classification,
+            max_tokens=MAX_OUTPUT_TOKENS,
         )
 
-        raw_output = response.choices[0].message.content
-        log.debug(f"Raw LLM output (first 500 chars): {raw_output[:500]}")
-
-        result = json.loads(raw_output)
-        validated = _validate_result(result)
-
-        if validated:
-            log.info(
-                f"LLM returned: {len(validated.get('tasks', []))} tasks, "
-                f"{len(validated.get('ideas', []))} ideas, "
-                f"{len(validated.get('vague', []))} vague"
-            )
+        message = response.choices[0].message
+        if message.parsed is None:
+            log.error(f"LLM refused to classify chunk: {message.refusal}")
+            return None
+
+        classification = message.parsed
+        validated = classification.model_dump()
+        log.info(
+            f"LLM returned: {len(validated['tasks'])} tasks, "
+            f"{len(validated['ideas'])} ideas, "
+            f"{len(validated['vague'])} vague"
+        )
+        _cache_put(cache_key, classification.model_dump_json())
         return validated
 
-    except json.JSONDecodeError as e:
-        log.error(f"LLM returned invalid JSON: {e}")
-        return None
+    except LengthFinishReasonError:
+        if len(notes) == 1:
+            log.error(f"LLM output truncated at max_tokens for single note {notes[0]['id']} — skipping")
+            return None
+        log.warning(f"LLM output truncated at max_tokens for {len(notes)} notes — splitting chunk and retrying")
     except Exception as e:
         log.error(f"OpenAI API error: {e}")
         return None
 
+    # Halves run one after the other so the caller's concurrency slot still holds
+    mid = len(notes) // 2
+    halves = [await extract_and_classify(notes[:mid]), await extract_and_classify(notes[mid:])]
+    return _merge_results([h for h in halves if h])
 
-def _format_notes_for_prompt(notes: list[dict]) -> str:
-    """Format notes into a clean text block for the LLM."""
-    parts = []
-    for note in notes:
-        header = f"--- NOTE [{note['id']}] ---"
-        title = f"Title: {note['title']}" if note['title'] else "Title: (none)"
-        content = f"Content: {note['content'][:500]}"  # Truncate long notes
-        created = f"Created: {note['created_at']}"
-        updated = f"Updated: {note['updated_at']}"
-        labels = f"Labels: {', '.join(note['labels'])}" if note['labels'] else ""
 
-        entry = f"{header}\n{title}\n{content}\n{created}\n{updated}"
-        if labels:
-            entry += f"\n{labels}"
-        parts.append(entry)
+def _merge_results(results: list[dict]) -> dict | None:
+    """Concatenate classification dicts from split chunks."""
+    if not results:
+        return None
+    return {key: [item for r in results for item in r[key]] for key in Classification.model_fields}
+
 
-    return "\n\n".join(parts)
+def _cache_path(key: str) -> Path:
+    """Shard cache files by key prefix to keep directories small."""
+    return CACHE_DIR / key[:2] / f"{key}.json"
 
 
-def _validate_result(result: dict) -> dict | None:
+def _cache_get(key: str) -> dict | None:
+    """Return a cached result, or None on miss / expiry / corruption."""
+    path = _cache_path(key)
+    try:
+        if _cache_expired(path):
+            path.unlink(missing_ok=True)
+            return None
+        # Decode + validate in one pass (pydantic-core) — no intermediate json.loads
+        result = Classification.model_validate_json(path.read_bytes()).model_dump()
+        os.utime(path)  # mark as used — TTL counts from last use, not creation
+        return result
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as e:
+        log.warning(f"Ignoring unreadable cache entry {path.name}: {e}")
+        return None
+
+
+def _cache_expired(path: Path) -> bool:
+    return CACHE_TTL_HOURS > 0 and time.time() - path.stat().st_mtime > CACHE_TTL_HOURS * 3600
+
+
+def prune_cache() -> int:
     """
-    Validate the LLM output has the expected structure.
-    Fixes minor issues, rejects garbage.
+    Delete cache entries not used within CACHE_TTL_HOURS, plus stray temp files.
+    Chunks shift whenever notes change, so without this the cache only grows.
+    Returns the number of files removed.
     """
-    required_keys = ["tasks", "ideas", "references", "vague", "duplicates"]
-
-    for key in required_keys:
-        if key not in result:
-            log.warning(f"Missing key '{key}' in LLM output — adding empty list")
-            result[key] = []
-
-    # Validate tasks have required fields
-    valid_tasks = []
-    for t in result["tasks"]:
-        if isinstance(t, dict) and "task" in t:
-            # Ensure defaults
-            t.setdefault("domain", "uncategorised")
-            t.setdefault("urgency_detected", False)
-            t.setdefault("urgency_words", [])
-            t.setdefault("deadline_raw", None)
-            t.setdefault("source_note_ids", [])
-            t.setdefault("merged_from", [])
-            t.setdefault("original_snippet", "")
-            valid_tasks.append(t)
-        else:
-            log.warning(f"Dropping malformed task: {t}")
-
-    result["tasks"] = valid_tasks
-    return result
+    if CACHE_TTL_HOURS <= 0 or not CACHE_DIR.is_dir():
+        return 0
+
+    removed = 0
+    for path in CACHE_DIR.glob("*/*"):
+        try:
+            if path.suffix == ".tmp" or _cache_expired(path):
+                path.unlink()
+                removed += 1
+        except OSError as e:
+            log.warning(f"Could not prune cache entry {path.name}: {e}")
+
+    if removed:
+        log.info(f"Pruned {removed} stale LLM cache entr{'y' if removed == 1 else 'ies'}")
+    return removed
+
+
+def _cache_put(key: str, result_json: str) -> None:
+    """Atomically write a serialised result to the cache. Failures are non-fatal."""
+    path = _cache_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(result_json)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning(f"Could not write cache entry {path.name}: {e}")
+
+
+def format_note(note: dict) -> str:
+    """
+    Format a single note as it appears in the prompt (compact field tags).
+    Memoised on the note as `_formatted` — chunking and prompt assembly reuse it.
+    """
+    formatted = note.get("_formatted")
+    if formatted is None:
+        formatted = f"#{note['id']}\nT:{note['title']}\nC:{note['content'][:500]}\nU:{note['updated_at']}"  # Truncate long notes
+        if note['labels']:
+            formatted += f"\nL:{','.join(note['labels'])}"
+        note["_formatted"] = formatted
+    return formatted
+
+
+def _format_notes_for_prompt(notes: list[dict]) -> str:
+    """Format notes into a clean text block for the LLM."""
+    return "\n\n".join(format_note(note) for note in notes)
@@ -12,7 +12,12 @@ Design:
   - All weights are tunable constants — iterate based on usefulness
 """
 
+import heapq
 import logging
+from bisect import bisect_right
+from collections import Counter
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime, timezone
 
 log = logging.getLogger("keep_agent.scoring")
@@ -61,6 +66,7 @@ STALENESS_THRESHOLDS = [
     (14, 5),    # 2+ weeks old → +5
     (0, 0),     # Recent → no bonus
 ]
+_STALENESS_DAYS, _STALENESS_BONUS = zip(*sorted(STALENESS_THRESHOLDS))  # ascending, for bisect
 
 # Domain balance: expected minimum % of tasks per domain
 # If a domain has fewer tasks than this %, it's "neglected"
@@ -79,26 +85,38 @@ DOMAIN_BALANCE_THRESHOLDS = {
 # Scoring Functions
 # ===========================================================================
 
-def score_tasks(tasks: list[dict]) -> list[dict]:
+def score_tasks(tasks: list[dict], sort: bool = True) -> list[dict]:
     """
     Apply deterministic priority scoring to each task.
-    Returns tasks sorted by priority_score (descending).
+    Returns tasks sorted by priority_score (descending), or in input
+    order when sort=False — use top_k_tasks for the highest-priority few.
     """
-    for task in tasks:
-        urgency = _score_urgency(task)
-        impact = _score_impact(task)
-        staleness = _score_staleness(task)
-
-        task["score_urgency"] = urgency
-        task["score_impact"] = impact
-        task["score_staleness"] = staleness
-        task["priority_score"] = urgency + impact + staleness
+    now = datetime.now(timezone.utc)  # one reference time for the whole batch
+
+    # Column-wise pass: one score list per factor, then a single write-back
+    urgency = list(map(_score_urgency, tasks))
+    impact = list(map(_score_impact, tasks))
+    staleness = [_score_staleness(t, now) for t in tasks]
+    priority = [u + i + s for u, i, s in zip(urgency, impact, staleness)]
+
+    for task, u, i, s, p in zip(tasks, urgency, impact, staleness, priority):
+        task["score_urgency"] = u
+        task["score_impact"] = i
+        task["score_staleness"] = s
+        task["priority_score"] = p
+
+    # Sort descending by priority score — argsort on the score column
+    if sort:
+        order = sorted(range(len(tasks)), key=priority.__getitem__, reverse=True)
+        tasks[:] = [tasks[i] for i in order]
+
+    log.info(f"Scored {len(tasks)} tasks. Top score: {max(priority):.0f}" if tasks else "No tasks to score")
+    return tasks
 
-    # Sort descending by priority score
-    tasks.sort(key=lambda t: t["priority_score"], reverse=True)
 
-    log.info(f"Scored {len(tasks)} tasks. Top score: {tasks[0]['priority_score']:.0f}" if tasks else "No tasks to score")
-    return tasks
+def top_k_tasks(tasks: list[dict], k: int = 5) -> list[dict]:
+    """Highest-priority k tasks in O(n log k) — no need to sort the full list."""
+    return heapq.nlargest(k, tasks, key=itemgetter("priority_score"))
 
 
 def _score_urgency(task: dict) -> float:
@@ -109,11 +127,7 @@ def _score_urgency(task: dict) -> float:
         score += URGENCY_BASE_SCORE
 
     for word in task.get("urgency_words", []):
-        word_lower = word.lower().strip()
-        for key, bonus in URGENCY_WORD_BONUS.items():
-            if key in word_lower:
-                score += bonus
-                break  # Only count each word once
+        score += _urgency_word_bonus(word.lower().strip())
 
     # Bonus if a specific deadline was detected
     if task.get("deadline_raw"):
@@ -122,39 +136,45 @@ def _score_urgency(task: dict) -> float:
     return min(score, 80)  # Cap urgency contribution
 
 
+@lru_cache(maxsize=1024)
+def _urgency_word_bonus(word_lower: str) -> float:
+    """Bonus for the first urgency keyword found in a word — each word counts once."""
+    for key, bonus in URGENCY_WORD_BONUS.items():
+        if key in word_lower:
+            return bonus
+    return 0
+
+
 def _score_impact(task: dict) -> float:
     """Score based on life domain importance."""
-    domain = task.get("domain", "uncategorised").lower()
+    domain = (task.get("domain") or "uncategorised").lower()
     return DOMAIN_IMPACT_WEIGHT.get(domain, 5)
 
 
-def _score_staleness(task: dict) -> float:
+def _score_staleness(task: dict, now: datetime | None = None) -> float:
     """Score based on note age — older unactioned notes need attention."""
     # Try to parse the creation date from source note
     # The LLM extraction may not carry this forward, so we handle gracefully
     updated = task.get("note_updated_at") or task.get("created_at")
 
-    if not updated:
+    if not updated or not isinstance(updated, str):
         return 0
 
     try:
-        if isinstance(updated, str):
-            # Handle ISO format
-            updated_dt = datetime.fromisoformat(updated.replace("Z", "+00:00"))
-        else:
-            return 0
-
-        now = datetime.now(timezone.utc)
+        updated_dt = _parse_iso(updated)
+        now = now or datetime.now(timezone.utc)
         days_old = (now - updated_dt).days
+    except (ValueError, TypeError):
+        return 0
 
-        for threshold_days, bonus in STALENESS_THRESHOLDS:
-            if days_old >= threshold_days:
-                return bonus
+    idx = bisect_right(_STALENESS_DAYS, days_old) - 1
+    return _STALENESS_BONUS[idx] if idx >= 0 else 0
 
-    except (ValueError, TypeError):
-        pass
 
-    return 0
+@lru_cache(maxsize=4096)
+def _parse_iso(ts: str) -> datetime:
+    """Parse an ISO timestamp — cached, since tasks from one note share it."""
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
 
 
 # ===========================================================================
@@ -170,10 +190,9 @@ def detect_domain_imbalance(tasks: list[dict]) -> list[str]:
         return ["⚠️ No tasks extracted — cannot assess domain balance"]
 
     # Count tasks per domain
-    domain_counts = {}
-    for t in tasks:
-        d = t.get("domain", "uncategorised").lower()
-        domain_counts[d] = domain_counts.get(d, 0) + 1
+    domain_counts = Counter(
+        (t.get("domain", "uncategorised") or "uncategorised").lower() for t in tasks
+    )
 
     total = len(tasks)
     warnings = []
@@ -1,7 +1,7 @@
 """
 📱 Telegram Notification Module
 =================================
-Simple HTTPS POST to Telegram Bot API.
+Simple HTTPS POST to Telegram Bot API over a pooled, reused connection.
 
 Setup:
   1. Message @BotFather on Telegram → /newbot → get token
@@ -11,10 +11,10 @@ Setup:
   3. Set env vars: TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
 """
 
+import time
 import logging
-import urllib.request
-import urllib.parse
-import json
+
+import httpx
 
 log = logging.getLogger("keep_agent.telegram")
 
@@ -23,12 +23,25 @@ TELEGRAM_API = "https://api.telegram.org/bot{token}/sendMessage"
 # Telegram message length limit
 MAX_MESSAGE_LENGTH = 4096
 
+# Retries for rate limits (429) and server errors (5xx) — honours Retry-After
+MAX_RETRIES = 3
+MAX_RETRY_DELAY = 30  # seconds — give up rather than outwait the workflow timeout
+
+# Only errors where the request never reached Telegram are safe to retry —
+# sendMessage isn't idempotent, so a read timeout could duplicate the brief
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# One client per process — keeps the TCP/TLS connection open across sends
+_session = httpx.Client(timeout=10)
+
 
 def send_telegram_message(text: str, bot_token: str, chat_id: str) -> bool:
     """
     Send a message via Telegram Bot API.
     Uses Markdown parsing for formatting.
     Falls back to plain text if Markdown fails.
+    Messages over the Telegram limit are split on line boundaries
+    and sent in order.
     
     Returns True on success.
     """
@@ -36,14 +49,51 @@ def send_telegram_message(text: str, bot_token: str, chat_id: str) -> bool:
         log.error("Missing Telegram credentials")
         return False
 
-    # Truncate if too long
-    if len(text) > MAX_MESSAGE_LENGTH:
-        text = text[:MAX_MESSAGE_LENGTH - 50] + "\n\n_...truncated_"
-        log.warning("Message truncated to fit Telegram limit")
-
     url = TELEGRAM_API.format(token=bot_token)
 
-    # Try Markdown first, fall back to plain text
+    parts = _split_message(text)
+    if not parts:
+        log.error("Refusing to send an empty Telegram message")
+        return False
+    if len(parts) > 1:
+        log.info(f"Message exceeds Telegram limit — sending in {len(parts)} parts")
+
+    for part in parts:
+        if not _send_part(url, chat_id, part):
+            return False
+    return True
+
+
+def _split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Split text into parts of at most `limit` chars, breaking on line boundaries.
+    Whitespace-only parts are dropped — Telegram rejects empty messages.
+    """
+    parts = []
+    buf = []
+    size = 0
+
+    for line in text.splitlines(keepends=True):
+        # A single line longer than the limit has to be hard-split
+        while len(line) > limit:
+            if buf:
+                parts.append("".join(buf))
+                buf, size = [], 0
+            parts.append(line[:limit])
+            line = line[limit:]
+        if size + len(line) > limit:
+            parts.append("".join(buf))
+            buf, size = [], 0
+        buf.append(line)
+        size += len(line)
+
+    if buf:
+        parts.append("".join(buf))
+    return [p for p in parts if p.strip()]
+
+
+def _send_part(url: str, chat_id: str, text: str) -> bool:
+    """Send one message, trying Markdown first and falling back to plain text."""
     for parse_mode in ["Markdown", None]:
         payload = {
             "chat_id": chat_id,
@@ -54,30 +104,65 @@ def send_telegram_message(text: str, bot_token: str, chat_id: str) -> bool:
             payload["parse_mode"] = parse_mode
 
         try:
-            data = json.dumps(payload).encode("utf-8")
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers={"Content-Type": "application/json"},
-                method="POST",
-            )
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                result = json.loads(resp.read().decode())
-                if result.get("ok"):
-                    log.info(f"Message sent (parse_mode={parse_mode})")
-                    return True
-                else:
-                    log.warning(f"Telegram API returned ok=false: {result}")
-
-        except urllib.error.HTTPError as e:
-            body = e.read().decode() if e.fp else ""
-            log.warning(f"Telegram HTTP {e.code} (parse_mode={parse_mode}): {body}")
-            if parse_mode == "Markdown":
-                log.info("Retrying without Markdown formatting...")
-                continue
+            resp = _post_with_retry(url, payload)
+            result = resp.json() if resp.is_success else None
+        except ValueError:
+            log.error(f"Telegram returned a non-JSON response: {resp.text[:200]}")
             return False
         except Exception as e:
             log.error(f"Telegram request failed: {e}")
             return False
 
+        if result is not None:
+            if result.get("ok"):
+                log.info(f"Message sent (parse_mode={parse_mode})")
+                return True
+            log.warning(f"Telegram API returned ok=false: {result}")
+            continue
+
+        log.warning(f"Telegram HTTP {resp.status_code} (parse_mode={parse_mode}): {resp.text}")
+        # Only a 400 can be a Markdown parse error — anything else would fail again as plain text
+        if parse_mode == "Markdown" and resp.status_code == 400:
+            log.info("Retrying without Markdown formatting...")
+            continue
+        return False
+
     return False
+
+
+def _post_with_retry(url: str, payload: dict) -> httpx.Response:
+    """
+    POST on the shared session, retrying 429 / 5xx / connection errors
+    with exponential backoff. Returns the last response — early if the
+    server asks for a wait above MAX_RETRY_DELAY; raises if the final
+    attempt fails at the transport level.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = _session.post(url, json=payload)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = 2 ** attempt
+            log.warning(f"Telegram connection error ({e}) — retrying in {delay}s")
+        else:
+            if (resp.status_code != 429 and resp.status_code < 500) or attempt == MAX_RETRIES:
+                return resp
+            delay = _retry_after(resp)
+            if delay is None:
+                delay = 2 ** attempt
+            elif delay > MAX_RETRY_DELAY:
+                log.warning(f"Telegram asked to wait {delay}s — exceeds {MAX_RETRY_DELAY}s, giving up")
+                return resp
+            log.warning(f"Telegram HTTP {resp.status_code} — retrying in {delay}s")
+        time.sleep(delay)
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    """Seconds to wait, from the Retry-After header or Telegram's parameters.retry_after."""
+    try:
+        if "Retry-After" in resp.headers:
+            return float(resp.headers["Retry-After"])
+        return float(resp.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return None